@@ -0,0 +1,20 @@
+"""
+Helpers shared by the OpenAQ client and the sample data
+"""
+import bisect
+
+# Upper AQI bound of each category; anything above the last is Hazardous
+AQI_CATEGORY_LIMITS = (50, 100, 150, 200, 300)
+AQI_CATEGORIES = (
+    "Good",
+    "Moderate",
+    "Unhealthy for Sensitive Groups",
+    "Unhealthy",
+    "Very Unhealthy",
+    "Hazardous",
+)
+
+
+def get_aqi_category(aqi: int) -> str:
+    """Get AQI category from AQI index"""
+    return AQI_CATEGORIES[bisect.bisect_left(AQI_CATEGORY_LIMITS, aqi)]
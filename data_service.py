@@ -2,16 +2,21 @@
 Data Service - Fetches data from OpenAQ API with fallback to sample data
 """
 import os
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, Callable, Awaitable
 from datetime import datetime
+from collections import OrderedDict
 import asyncio
+import logging
+import time
 
 from openaq_client import (
     fetch_countries as fetch_openaq_countries,
     fetch_locations,
     fetch_measurements,
     aggregate_city_data,
+    match_city_locations,
     calculate_aqi_from_pm25,
+    openaq_slots_available,
     API_KEY,
     USE_FALLBACK,
 )
@@ -25,60 +30,291 @@ from sample_data import (
     get_aqi_category,
 )
 
+logger = logging.getLogger(__name__)
 
-def use_openaq() -> bool:
-    """Check if we should use OpenAQ API"""
-    return bool(API_KEY) and not USE_FALLBACK
+
+# Sample heatmap points never change - build them once instead of per request.
+# Shared by all requests, so callers must not mutate them.
+_HEATMAP_BY_COUNTRY: Dict[str, List[Dict[str, Any]]] = {
+    country_code: [
+        {
+            "city": city_data.city,
+            "country": country_code,
+            "latitude": city_data.lat,
+            "longitude": city_data.lon,
+            "pm25": city_data.pm25,
+            "aqiIndex": city_data.aqiIndex,
+            "aqiCategory": city_data.aqiCategory,
+        }
+        for city_data in cities
+    ]
+    for country_code, cities in SAMPLE_CITIES.items()
+}
+_HEATMAP_ALL: List[Dict[str, Any]] = [
+    point for points in _HEATMAP_BY_COUNTRY.values() for point in points
+]
+
+
+# Sample countries are static - materialize them once
+_SAMPLE_COUNTRIES_LIST: List[Dict[str, Any]] = get_sample_countries()
+_SAMPLE_COUNTRIES_BY_CODE: Dict[str, Dict[str, Any]] = {
+    c.get("code"): c for c in _SAMPLE_COUNTRIES_LIST
+}
+# Sample USA entry, added when OpenAQ's country list doesn't include it
+_SAMPLE_US: Optional[Dict[str, Any]] = _SAMPLE_COUNTRIES_BY_CODE.get("US")
+
+
+# Whether to use the OpenAQ API - fixed for the process lifetime, so evaluate once
+USE_OPENAQ: bool = bool(API_KEY) and not USE_FALLBACK
+
+# In-process TTL cache for OpenAQ results. Misses go through _singleflight, so
+# concurrent requests for the same key share one upstream fetch.
+# TTLs per data class (seconds):
+COUNTRIES_TTL = 86400  # the country list changes on the order of days
+CITY_DATA_TTL = 900  # latest values refresh on the order of 15 min
+HISTORY_TTL = 1800  # past days don't change, only today's bucket does
+# Entry caps per data class (the key prefix before ":"), least recently used
+# evicted first - a crawl of history URLs can't push out countries or city data
+CACHE_MAX_ENTRIES = {
+    "countries": 1,
+    "city_data": 64,
+    "history": 256,
+}
+
+# (locations, city_data, lower_index, locations_by_city_lower) - see aggregate_city_data
+CityData = Tuple[
+    List[Dict[str, Any]],
+    Dict[str, Dict[str, Any]],
+    Dict[str, str],
+    Dict[str, List[Dict[str, Any]]],
+]
+
+_caches: Dict[str, "OrderedDict[str, Tuple[float, Any]]"] = {
+    data_class: OrderedDict() for data_class in CACHE_MAX_ENTRIES
+}
+_inflight: Dict[str, asyncio.Task] = {}
+
+# Optional Redis second-level cache, shared by all workers, enabled by REDIS_URL.
+# Without it (or while Redis is unreachable) each worker uses only its own cache.
+REDIS_URL = os.getenv("REDIS_URL", "").strip()
+REDIS_TIMEOUT = 0.5  # seconds; a slow Redis must not be slower than OpenAQ
+REDIS_RETRY_AFTER = 30  # seconds to skip Redis after a failed call
+_shared_cache = None
+_shared_down_until = 0.0
+if REDIS_URL:
+    try:
+        from aiocache import Cache
+        from aiocache.serializers import JsonSerializer
+
+        _shared_cache = Cache.from_url(REDIS_URL)
+        _shared_cache.serializer = JsonSerializer()
+        _shared_cache.timeout = REDIS_TIMEOUT
+    except ImportError:
+        logger.warning("REDIS_URL is set but aiocache is not installed - using in-process cache only")
+    except Exception as e:
+        # e.g. aiocache without the redis extra, or a URL without a scheme
+        _shared_cache = None
+        logger.warning("Shared cache unavailable for REDIS_URL - using in-process cache only: %s", e)
+
+
+# Finished loads keep answering for this long, so a burst that arrives just
+# after a load that wasn't cached (empty result or error) still shares it
+COALESCE_WINDOW = 0.02  # seconds
+
+
+def _release_inflight(key: str, task: asyncio.Task) -> None:
+    if _inflight.get(key) is task:
+        del _inflight[key]
+
+
+async def _singleflight(key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+    """Run factory() at most once at a time per key; concurrent callers share the result"""
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(factory())
+        _inflight[key] = task
+        task.add_done_callback(
+            lambda t: t.get_loop().call_later(COALESCE_WINDOW, _release_inflight, key, t)
+        )
+    # Shield so a cancelled request doesn't cancel the call other requests await.
+    # Exceptions are re-raised to every caller.
+    return await asyncio.shield(task)
+
+
+def _cache_for(key: str) -> "OrderedDict[str, Tuple[float, Any]]":
+    """The in-process cache holding key's data class"""
+    return _caches[key.partition(":")[0]]
+
+
+def _cache_store(key: str, loaded_at: float, value: Any) -> None:
+    """Put a value in the in-process cache, evicting least recently used entries of its class"""
+    data_class = key.partition(":")[0]
+    cache = _caches[data_class]
+    cache[key] = (loaded_at, value)
+    cache.move_to_end(key)
+    while len(cache) > CACHE_MAX_ENTRIES[data_class]:
+        cache.popitem(last=False)
+
+
+def _shared_available() -> bool:
+    """Whether to use the shared cache - skipped for a while after it fails"""
+    return _shared_cache is not None and time.monotonic() >= _shared_down_until
+
+
+def _shared_failed() -> None:
+    global _shared_down_until
+    _shared_down_until = time.monotonic() + REDIS_RETRY_AFTER
+
+
+async def _shared_get(key: str) -> Optional[Tuple[float, Any]]:
+    """(stored_at wall-clock time, value) from the shared cache, or None"""
+    if not _shared_available():
+        return None
+    try:
+        return await _shared_cache.get(key)
+    except Exception as e:
+        _shared_failed()
+        logger.warning("Shared cache read failed for %s, skipping it for %ss: %s", key, REDIS_RETRY_AFTER, e)
+        return None
+
+
+async def _shared_set(key: str, value: Any, ttl: float) -> None:
+    if not _shared_available():
+        return
+    try:
+        await _shared_cache.set(key, (time.time(), value), ttl=int(ttl))
+    except Exception as e:
+        _shared_failed()
+        logger.warning("Shared cache write failed for %s, skipping it for %ss: %s", key, REDIS_RETRY_AFTER, e)
+
+
+async def _cached(key: str, ttl: float, loader: Callable[[], Awaitable[Any]]) -> Any:
+    """Return the cached value for key, or load it (at most once per TTL)"""
+    cache = _cache_for(key)
+    entry = cache.get(key)
+    if entry and time.monotonic() - entry[0] < ttl:
+        cache.move_to_end(key)
+        return entry[1]
+
+    async def load() -> Any:
+        # Another worker may already have loaded it; keep its age so the
+        # entry still expires ttl seconds after the upstream fetch
+        shared = await _shared_get(key)
+        if shared:
+            stored_at, value = shared
+            age = max(time.time() - stored_at, 0.0)
+            if age < ttl:
+                _cache_store(key, time.monotonic() - age, value)
+                return value
+
+        value = await loader()
+        # Don't cache empty results - the client returns [] on upstream errors
+        if value:
+            _cache_store(key, time.monotonic(), value)
+            await _shared_set(key, value, ttl)
+        return value
+
+    return await _singleflight(key, load)
+
+
+async def _load_city_data(country_code: str) -> Optional[CityData]:
+    """Fetch locations for a country and aggregate them by city"""
+    locations = await fetch_locations(country_code, limit=200)
+    if not locations:
+        return None
+    city_data, lower_index, locations_by_city_lower = await aggregate_city_data(locations)
+    return locations, city_data, lower_index, locations_by_city_lower
+
+
+async def _load_history(city: str, country_code: str, days: int) -> List[Dict[str, Any]]:
+    """Fetch a city's daily history"""
+    # Station lookup reuses the cached locations instead of refetching them per history miss
+    _, _, _, locations_by_city_lower = await _get_city_data_cached(country_code)
+    return await fetch_measurements(
+        city=city, country_code=country_code, days=days, locations_by_city_lower=locations_by_city_lower
+    )
+
+
+def _normalize_country(country_code: str) -> str:
+    """Canonical form of a country code, used for cache keys and sample lookups"""
+    return country_code.strip().upper()
+
+
+async def _get_city_data_cached(country_code: str, ttl: float = CITY_DATA_TTL) -> CityData:
+    """Get locations + aggregated city data for a country, shared by cities/summary/stations/heatmap"""
+    city_data = await _cached(f"city_data:{country_code}", ttl, lambda: _load_city_data(country_code))
+    return city_data or ([], {}, {}, {})
+
+
+# Countries whose data is refreshed in the background so requests never miss
+WARM_COUNTRIES = [
+    _normalize_country(c) for c in os.getenv("WARM_COUNTRIES", "IN,US,GB,DE,BR,CN,JP,AU").split(",") if c.strip()
+]
+CACHE_WARM_INTERVAL = 600  # seconds - shorter than the TTLs, so entries are replaced before they expire
+
+
+async def keep_cache_warm() -> None:
+    """Background task: periodically reload the country list and WARM_COUNTRIES city data"""
+    if not USE_OPENAQ:
+        return
+    while True:
+        # City data older than the warm interval is reloaded; countries only
+        # once they would expire before the next pass
+        results = await asyncio.gather(
+            _cached("countries", max(COUNTRIES_TTL - CACHE_WARM_INTERVAL, 0), fetch_openaq_countries),
+            *(_get_city_data_cached(cc, ttl=CACHE_WARM_INTERVAL) for cc in WARM_COUNTRIES),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning("OpenAQ cache warm-up failed: %s", result)
+        await asyncio.sleep(CACHE_WARM_INTERVAL)
 
 
 async def get_countries() -> List[Dict[str, Any]]:
     """Get countries - try OpenAQ first, fallback to sample"""
-    if use_openaq():
+    if USE_OPENAQ:
         try:
-            openaq_countries = await fetch_openaq_countries()
+            openaq_countries = await _cached("countries", COUNTRIES_TTL, fetch_openaq_countries)
             if openaq_countries:
-                # Transform to our format
-                result = []
-                for country in openaq_countries:
-                    result.append({
+                # Transform to our format, keyed by code
+                by_code = {
+                    country.get("code", ""): {
                         "code": country.get("code", ""),
                         "name": country.get("name", ""),
                         "cityCount": 0,  # Will be calculated
                         "averageAqi": 0,
                         "worstCity": "",
                         "worstCityAqi": 0,
-                    })
+                    }
+                    for country in openaq_countries
+                }
                 
                 # Add USA if not present (OpenAQ might not have it)
-                us_found = any(c.get("code") == "US" for c in result)
-                if not us_found:
-                    # Get sample USA data and add it
-                    sample_countries = get_sample_countries()
-                    us_sample = next((c for c in sample_countries if c.get("code") == "US"), None)
-                    if us_sample:
-                        result.append(us_sample)
+                if "US" not in by_code and _SAMPLE_US:
+                    by_code["US"] = _SAMPLE_US
                 
-                return result
+                return list(by_code.values())
         except Exception as e:
-            print(f"OpenAQ API error, using sample data: {e}")
+            logger.warning("OpenAQ API error in get_countries, using sample data: %s", e, exc_info=True)
     
     # Fallback to sample data
-    return get_sample_countries()
+    return _SAMPLE_COUNTRIES_LIST
 
 
 async def get_cities(country_code: str) -> List[Dict[str, Any]]:
     """Get cities for a country - try OpenAQ first, fallback to sample"""
-    if use_openaq():
+    country_code = _normalize_country(country_code)
+    if USE_OPENAQ:
         try:
-            locations = await fetch_locations(country_code, limit=200)
+            locations, city_data, _, _ = await _get_city_data_cached(country_code)
             if locations:
-                # Aggregate by city
-                city_data = await aggregate_city_data(locations)
+                # Aggregated by city
                 cities_list = list(city_data.values())
                 if cities_list:
                     return cities_list
         except Exception as e:
-            print(f"OpenAQ API error, using sample data: {e}")
+            logger.warning("OpenAQ API error in get_cities, using sample data: %s", e, exc_info=True)
     
     # Fallback to sample data
     return get_sample_cities(country_code)
@@ -86,20 +322,19 @@ async def get_cities(country_code: str) -> List[Dict[str, Any]]:
 
 async def get_city_summary(city: str, country_code: str) -> Optional[Dict[str, Any]]:
     """Get city summary - try OpenAQ first, fallback to sample"""
-    if use_openaq():
+    country_code = _normalize_country(country_code)
+    if USE_OPENAQ:
         try:
-            locations = await fetch_locations(country_code, limit=200)
+            locations, city_data, lower_index, _ = await _get_city_data_cached(country_code)
             if locations:
-                city_data = await aggregate_city_data(locations)
                 # Try exact match first, then case-insensitive
                 if city in city_data:
                     return city_data[city]
-                # Try case-insensitive match
-                for city_name, data in city_data.items():
-                    if city.lower() == city_name.lower():
-                        return data
+                canonical = lower_index.get(city.lower())
+                if canonical:
+                    return city_data[canonical]
         except Exception as e:
-            print(f"OpenAQ API error, using sample data: {e}")
+            logger.warning("OpenAQ API error in get_city_summary, using sample data: %s", e, exc_info=True)
     
     # Fallback to sample data
     return get_sample_city_summary(city, country_code)
@@ -107,65 +342,77 @@ async def get_city_summary(city: str, country_code: str) -> Optional[Dict[str, A
 
 async def get_city_history(city: str, country_code: str, days: int = 30) -> List[Dict[str, Any]]:
     """Get city historical data - try OpenAQ first, fallback to sample"""
-    if use_openaq():
+    country_code = _normalize_country(country_code)
+    if USE_OPENAQ:
         try:
-            history = await fetch_measurements(city=city, country_code=country_code, days=days)
+            # Keyed by the UTC day too, so the "last N days" window rolls over at midnight
+            today = datetime.utcnow().date().isoformat()
+            history = await _cached(
+                f"history:{country_code}:{city}:{days}:{today}",
+                HISTORY_TTL,
+                lambda: _load_history(city, country_code, days),
+            )
             if history:
                 return history
         except Exception as e:
-            print(f"OpenAQ API error, using sample data: {e}")
+            logger.warning("OpenAQ API error in get_city_history, using sample data: %s", e, exc_info=True)
     
-    # Fallback to sample data
-    return generate_sample_historical_data(city, days)
+    # Fallback to sample data (generated in a worker thread - up to 90 days of
+    # synthetic readings shouldn't hold up the event loop)
+    return await asyncio.to_thread(generate_sample_historical_data, city, days)
 
 
 async def get_city_stations(city: str, country_code: str) -> List[Dict[str, Any]]:
     """Get city stations - try OpenAQ first, fallback to sample"""
-    if use_openaq():
+    country_code = _normalize_country(country_code)
+    if USE_OPENAQ:
         try:
-            locations = await fetch_locations(country_code, limit=200)
+            locations, _, _, locations_by_city_lower = await _get_city_data_cached(country_code)
             if locations:
-                # Filter locations for this city
-                city_locations = [
-                    loc for loc in locations
-                    if city.lower() in loc.get("city", "").lower()
-                ]
+                # Same matching rule as the city's history
+                city_locations = match_city_locations(locations_by_city_lower, city)
                 
                 stations = []
+                now_iso = datetime.now().isoformat()
                 for loc in city_locations[:5]:  # Limit to 5 stations
                     pm25 = loc.get("pm25", 0)
-                    aqi = calculate_aqi_from_pm25(pm25) if pm25 > 0 else 0
+                    pm10 = loc.get("pm10", 0)
+                    no2 = loc.get("no2", 0)
+                    o3 = loc.get("o3", 0)
+                    co = loc.get("co", 0)
+                    so2 = loc.get("so2", 0)
                     
                     stations.append({
                         "stationName": loc.get("name", "Unknown Station"),
                         "latitude": loc.get("lat", 0),
                         "longitude": loc.get("lon", 0),
-                        "pm25": round(loc.get("pm25", 0), 1),
-                        "pm10": round(loc.get("pm10", 0), 1),
-                        "no2": round(loc.get("no2", 0), 1),
-                        "o3": round(loc.get("o3", 0), 1),
-                        "co": round(loc.get("co", 0), 2),
-                        "so2": round(loc.get("so2", 0), 1),
-                        "aqiIndex": aqi,
-                        "lastUpdated": loc.get("lastUpdated", datetime.now().isoformat()),
+                        "pm25": round(pm25, 1),
+                        "pm10": round(pm10, 1),
+                        "no2": round(no2, 1),
+                        "o3": round(o3, 1),
+                        "co": round(co, 2),
+                        "so2": round(so2, 1),
+                        "aqiIndex": calculate_aqi_from_pm25(pm25) if pm25 > 0 else 0,
+                        "lastUpdated": loc.get("lastUpdated") or now_iso,
                     })
                 
                 if stations:
                     return stations
         except Exception as e:
-            print(f"OpenAQ API error, using sample data: {e}")
+            logger.warning("OpenAQ API error in get_city_stations, using sample data: %s", e, exc_info=True)
     
     # Fallback to sample data
-    return generate_sample_stations(city, country_code)
+    return await asyncio.to_thread(generate_sample_stations, city, country_code)
 
 
 async def get_heatmap_points(country_code: Optional[str] = None) -> List[Dict[str, Any]]:
     """Get heatmap points - try OpenAQ first, fallback to sample data"""
-    if use_openaq() and country_code:
+    if country_code:
+        country_code = _normalize_country(country_code)
+    if USE_OPENAQ and country_code:
         try:
-            locations = await fetch_locations(country_code, limit=200)
+            locations, city_data, _, _ = await _get_city_data_cached(country_code)
             if locations:
-                city_data = await aggregate_city_data(locations)
                 points = []
                 for city_name, data in city_data.items():
                     points.append({
@@ -180,34 +427,9 @@ async def get_heatmap_points(country_code: Optional[str] = None) -> List[Dict[st
                 if points:
                     return points
         except Exception as e:
-            print(f"OpenAQ API error for heatmap, using sample data: {e}")
+            logger.warning("OpenAQ API error in get_heatmap_points, using sample data: %s", e, exc_info=True)
     
     # Fallback to sample data
-    points = []
     if country_code:
-        cities = SAMPLE_CITIES.get(country_code, [])
-        for city_data in cities:
-            points.append({
-                "city": city_data["city"],
-                "country": country_code,
-                "latitude": city_data["lat"],
-                "longitude": city_data["lon"],
-                "pm25": city_data["pm25"],
-                "aqiIndex": city_data["aqiIndex"],
-                "aqiCategory": city_data["aqiCategory"],
-            })
-    else:
-        for country_code, cities in SAMPLE_CITIES.items():
-            for city_data in cities:
-                points.append({
-                    "city": city_data["city"],
-                    "country": country_code,
-                    "latitude": city_data["lat"],
-                    "longitude": city_data["lon"],
-                    "pm25": city_data["pm25"],
-                    "aqiIndex": city_data["aqiIndex"],
-                    "aqiCategory": city_data["aqiCategory"],
-                })
-    
-    return points
-
+        return _HEATMAP_BY_COUNTRY.get(country_code, [])
+    return _HEATMAP_ALL
@@ -1,7 +1,15 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Optional
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Any, Dict, Optional
+import asyncio
+import bisect
+import hashlib
 import os
+import orjson
 from dotenv import load_dotenv
 
 from data_service import (
@@ -11,8 +19,12 @@ from data_service import (
     get_city_history,
     get_city_stations,
     get_heatmap_points,
+    openaq_slots_available,
+    keep_cache_warm,
 )
-import httpx
+from openaq_client import OPENAQ_API_BASE, get_session, close_session
+from common import AQI_CATEGORY_LIMITS
+import aiohttp
 from sample_data import SAMPLE_CITIES
 import pathlib
 
@@ -27,13 +39,81 @@ else:
 
 # Log environment status
 import logging
+import logging.handlers
+import queue
 logger = logging.getLogger(__name__)
 # Strip whitespace and newlines from API key (common issue with environment variables)
 api_key = os.getenv("OPENAQ_API_KEY", "").strip()
 use_sample = os.getenv("USE_SAMPLE_DATA", "false").lower() == "true"
+# Headers for /api/test-key, which always sends the configured key explicitly
+_TEST_KEY_HEADERS = {
+    "Accept": "application/json",
+    "X-API-Key": api_key,
+}
 logger.info(f"Environment check - API_KEY present: {bool(api_key)}, API_KEY length: {len(api_key)}, USE_SAMPLE_DATA: {use_sample}")
 
-app = FastAPI(title="OpenAQ Global Air Dashboard API")
+# Log records are queued and written by a background thread, so a slow
+# stderr never blocks the event loop
+_log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+_log_queue_handler = logging.handlers.QueueHandler(_log_queue)
+_log_listener = logging.handlers.QueueListener(
+    _log_queue, logging.StreamHandler(), respect_handler_level=True
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logging.getLogger().addHandler(_log_queue_handler)
+    _log_listener.start()
+    # Create the shared OpenAQ session up front so every request reuses its pool
+    app.state.openaq_session = get_session()
+    cache_warmer = asyncio.create_task(keep_cache_warm())
+    try:
+        yield
+    finally:
+        cache_warmer.cancel()
+        await close_session()
+        _log_listener.stop()
+        logging.getLogger().removeHandler(_log_queue_handler)
+
+
+# orjson encodes the (large, float-heavy) payloads several times faster than stdlib json
+app = FastAPI(
+    title="OpenAQ Global Air Dashboard API",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
+
+# Cache-Control max-age per endpoint class (seconds), so browsers and the
+# edge/CDN can serve repeat requests without reaching this process
+CACHE_TTL_LATEST = 900  # latest readings - OpenAQ refreshes on the order of 15 min
+CACHE_TTL_HISTORY = 1800  # historical data is stable
+
+
+def set_cache_headers(response: Response, max_age: int) -> None:
+    """Mark a response as publicly cacheable for max_age seconds"""
+    response.headers["Cache-Control"] = f"public, max-age={max_age}, stale-while-revalidate=300"
+
+
+def etag_response(request: Request, content: Any, max_age: int) -> Response:
+    """JSON response with an ETag; returns an empty 304 if the client already has it"""
+    body = orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return etag_response_bytes(request, body, max_age)
+
+
+def etag_response_bytes(request: Request, body: bytes, max_age: int) -> Response:
+    """etag_response for an already serialized JSON body"""
+    etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+    if_none_match = request.headers.get("if-none-match", "")
+    client_etags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    if etag in client_etags or "*" in client_etags:
+        response = Response(status_code=304, headers={"ETag": etag})
+    else:
+        response = Response(body, media_type="application/json", headers={"ETag": etag})
+    set_cache_headers(response, max_age)
+    return response
+
 
 app.add_middleware(
     CORSMiddleware,
@@ -42,15 +122,15 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Heatmap/history/insights JSON compresses 5-10x; level 5 keeps CPU cost low
+app.add_middleware(GZipMiddleware, minimum_size=512, compresslevel=5)
 
 
-@app.get("/")
-async def read_root():
-    # Strip whitespace and newlines from API key (common issue with environment variables)
-    api_key = os.getenv("OPENAQ_API_KEY", "").strip()
+@lru_cache(maxsize=1)
+def _root_config() -> Dict[str, Any]:
+    """Static part of the / config block; the environment doesn't change at runtime"""
     # Check if API key exists and is not empty (has reasonable length)
     api_key_set = bool(api_key) and len(api_key) > 10
-    use_sample = os.getenv("USE_SAMPLE_DATA", "false").lower() == "true"
     
     # Show masked API key for debugging (first 10 chars + last 4 chars)
     api_key_preview = ""
@@ -60,15 +140,23 @@ async def read_root():
         else:
             api_key_preview = f"{api_key[:6]}...{api_key[-2:]}" if len(api_key) > 8 else "***"
     
+    return {
+        "api_key_configured": api_key_set,
+        "api_key_length": len(api_key) if api_key else 0,
+        "api_key_preview": api_key_preview,
+        "use_sample_data": use_sample,
+        "data_source": "sample" if (not api_key_set or use_sample) else "openaq",
+    }
+
+
+@app.get("/")
+async def read_root():
     return {
         "message": "OpenAQ Global Air Dashboard API",
         "version": "1.0.0",
         "config": {
-            "api_key_configured": api_key_set,
-            "api_key_length": len(api_key) if api_key else 0,
-            "api_key_preview": api_key_preview,
-            "use_sample_data": use_sample,
-            "data_source": "sample" if (not api_key_set or use_sample) else "openaq",
+            **_root_config(),
+            "openaq_slots_available": openaq_slots_available(),
         },
         "endpoints": [
             "/api/countries",
@@ -76,6 +164,7 @@ async def read_root():
             "/api/city/{city}/summary",
             "/api/city/{city}/history",
             "/api/city/{city}/stations",
+            "/api/city/{city}/overview",
             "/api/heatmap",
             "/api/insights",
             "/api/test-key",  # New endpoint to test API key
@@ -84,11 +173,8 @@ async def read_root():
 
 
 @app.get("/api/test-key")
-async def test_api_key():
+async def test_api_key(request: Request):
     """Test if the OpenAQ API key is working"""
-    # Strip whitespace and newlines from API key (common issue with environment variables)
-    api_key = os.getenv("OPENAQ_API_KEY", "").strip()
-    
     if not api_key or len(api_key) < 10:
         return {
             "status": "error",
@@ -98,43 +184,39 @@ async def test_api_key():
     
     try:
         # Try to make a simple API call to test the key
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            headers = {
-                "Accept": "application/json",
-                "X-API-Key": api_key,
-            }
-            # Try fetching countries as a simple test
-            response = await client.get(
-                "https://api.openaq.org/v3/countries",
-                headers=headers,
-                params={"limit": 1}
-            )
-            
-            if response.status_code == 200:
+        session = request.app.state.openaq_session
+        # Try fetching countries as a simple test
+        async with session.get(
+            f"{OPENAQ_API_BASE}/countries",
+            headers=_TEST_KEY_HEADERS,
+            params={"limit": 1},
+            timeout=aiohttp.ClientTimeout(total=10),
+        ) as response:
+            if response.status == 200:
                 return {
                     "status": "success",
                     "message": "API key is valid and working",
                     "api_key_length": len(api_key),
                     "api_key_preview": f"{api_key[:10]}...{api_key[-4:]}",
-                    "test_response_status": response.status_code,
+                    "test_response_status": response.status,
                 }
-            elif response.status_code == 401:
+            elif response.status == 401:
                 return {
                     "status": "error",
                     "message": "API key is invalid or unauthorized",
                     "api_key_length": len(api_key),
                     "api_key_preview": f"{api_key[:10]}...{api_key[-4:]}",
-                    "test_response_status": response.status_code,
+                    "test_response_status": response.status,
                     "error": "Unauthorized - check your API key",
                 }
             else:
-                error_text = response.text[:200]
+                error_text = (await response.text())[:200]
                 return {
                     "status": "error",
-                    "message": f"API call failed with status {response.status_code}",
+                    "message": f"API call failed with status {response.status}",
                     "api_key_length": len(api_key),
                     "api_key_preview": f"{api_key[:10]}...{api_key[-4:]}",
-                    "test_response_status": response.status_code,
+                    "test_response_status": response.status,
                     "error": error_text,
                 }
     except Exception as e:
@@ -146,9 +228,9 @@ async def test_api_key():
 
 
 @app.get("/api/countries")
-async def list_countries():
+async def list_countries(request: Request):
     countries = await get_countries()
-    return {"countries": countries}
+    return etag_response(request, {"countries": countries}, CACHE_TTL_LATEST)
 
 
 @app.get("/api/cities")
@@ -156,155 +238,225 @@ async def list_cities(country: str = Query(..., description="Country code (e.g.,
     cities = await get_cities(country)
     if not cities:
         raise HTTPException(status_code=404, detail=f"No cities found for country: {country}")
-    return {"country": country, "cities": cities}
+    # Can be hundreds of cities - return the response directly so it skips jsonable_encoder
+    response = ORJSONResponse({"country": country, "cities": cities})
+    set_cache_headers(response, CACHE_TTL_LATEST)
+    return response
 
 
 @app.get("/api/city/{city}/summary")
 async def city_summary(
     city: str,
+    response: Response,
     country: str = Query(..., description="Country code (e.g., IN, US)"),
 ):
     summary = await get_city_summary(city, country)
     if not summary:
         raise HTTPException(status_code=404, detail=f"City not found: {city}")
+    set_cache_headers(response, CACHE_TTL_LATEST)
     return summary
 
 
 @app.get("/api/city/{city}/history")
 async def city_history(
     city: str,
+    request: Request,
     country: str = Query(..., description="Country code (e.g., IN, US)"),
     days: int = Query(30, description="Number of days of history", ge=1, le=90),
 ):
     history = await get_city_history(city, country, days)
-    return {"city": city, "country": country, "history": history}
+    return etag_response(
+        request, {"city": city, "country": country, "history": history}, CACHE_TTL_HISTORY
+    )
 
 
 @app.get("/api/city/{city}/stations")
 async def city_stations(
     city: str,
+    response: Response,
     country: str = Query(..., description="Country code (e.g., IN, US)"),
 ):
     stations = await get_city_stations(city, country)
+    set_cache_headers(response, CACHE_TTL_LATEST)
     return {"city": city, "country": country, "stations": stations}
 
 
-@app.get("/api/heatmap")
-async def heatmap(country: Optional[str] = Query(None, description="Country code filter")):
-    points = await get_heatmap_points(country)
-    return {"points": points}
-
-
-@app.get("/api/insights")
-async def get_insights(
-    country: str = Query(..., description="Country code"),
-    city: str = Query(..., description="City name"),
+@app.get("/api/city/{city}/overview")
+async def city_overview(
+    city: str,
+    response: Response,
+    country: str = Query(..., description="Country code (e.g., IN, US)"),
+    days: int = Query(7, description="Number of days of history", ge=1, le=90),
 ):
-    summary = await get_city_summary(city, country)
+    # Independent lookups - run them concurrently instead of one after another
+    summary, history, stations = await asyncio.gather(
+        get_city_summary(city, country),
+        get_city_history(city, country, days),
+        get_city_stations(city, country),
+    )
     if not summary:
         raise HTTPException(status_code=404, detail=f"City not found: {city}")
-
-    aqi = summary["aqiIndex"]
-    category = summary["aqiCategory"]
-
-    insights = {
+    set_cache_headers(response, CACHE_TTL_LATEST)
+    return {
         "city": city,
         "country": country,
-        "aqi": aqi,
-        "category": category,
-        "health": {},
-        "activities": {},
+        "summary": summary,
+        "history": history,
+        "stations": stations,
     }
 
-    if aqi <= 50:
-        insights["health"] = {
+
+@app.get("/api/heatmap")
+async def heatmap(
+    request: Request,
+    country: Optional[str] = Query(None, description="Country code filter"),
+):
+    points = await get_heatmap_points(country)
+    return etag_response(request, {"points": points}, CACHE_TTL_LATEST)
+
+
+# (health, activities) advice per AQI category (tiers bounded by
+# AQI_CATEGORY_LIMITS), built once at import and shared by all requests
+# (read-only - never mutate these)
+_TIER_PAYLOADS = (
+    # Good (0-50)
+    (
+        {
             "general": "Air quality is excellent. No health concerns.",
             "sensitive": "Perfect conditions for everyone, including sensitive groups.",
             "children": "Ideal for outdoor play and activities.",
             "elderly": "Safe for all outdoor activities.",
             "asthma": "No restrictions for asthma patients.",
-        }
-        insights["activities"] = {
+        },
+        {
             "walking": {"safe": True, "recommendation": "Excellent for walking at any pace."},
             "running": {"safe": True, "recommendation": "Perfect for long runs and intense workouts."},
             "outdoor_play": {"safe": True, "recommendation": "Great day for kids to play outside."},
             "cycling": {"safe": True, "recommendation": "Ideal conditions for cycling."},
-        }
-    elif aqi <= 100:
-        insights["health"] = {
+        },
+    ),
+    # Moderate (51-100)
+    (
+        {
             "general": "Air quality is acceptable. Most people can engage in outdoor activities.",
             "sensitive": "Unusually sensitive people may experience minor symptoms.",
             "children": "Generally safe, but watch for any unusual symptoms.",
             "elderly": "Safe for moderate outdoor activities.",
             "asthma": "Most asthma patients can go about normal activities. Monitor for symptoms.",
-        }
-        insights["activities"] = {
+        },
+        {
             "walking": {"safe": True, "recommendation": "Good for walking. No restrictions."},
             "running": {"safe": True, "recommendation": "Safe for running, but sensitive individuals should monitor how they feel."},
             "outdoor_play": {"safe": True, "recommendation": "Children can play outside normally."},
             "cycling": {"safe": True, "recommendation": "Good conditions for cycling."},
-        }
-    elif aqi <= 150:
-        insights["health"] = {
+        },
+    ),
+    # Unhealthy for Sensitive Groups (101-150)
+    (
+        {
             "general": "Sensitive groups may experience health effects.",
             "sensitive": "People with heart or lung disease, children, and older adults should reduce prolonged outdoor exertion.",
             "children": "Active children should take breaks and reduce intense outdoor activities.",
             "elderly": "Older adults should limit prolonged outdoor exertion.",
             "asthma": "Asthma patients may experience symptoms. Keep quick-relief inhaler handy.",
-        }
-        insights["activities"] = {
+        },
+        {
             "walking": {"safe": True, "recommendation": "Light to moderate walking is okay. Sensitive groups should limit duration."},
             "running": {"safe": False, "recommendation": "Avoid intense running. Sensitive groups should skip outdoor workouts."},
             "outdoor_play": {"safe": True, "recommendation": "Limit prolonged or intense outdoor play for children."},
             "cycling": {"safe": True, "recommendation": "Moderate cycling is okay, but avoid intense efforts."},
-        }
-    elif aqi <= 200:
-        insights["health"] = {
+        },
+    ),
+    # Unhealthy (151-200)
+    (
+        {
             "general": "Everyone may begin to experience health effects. Sensitive groups may experience more serious effects.",
             "sensitive": "People with heart or lung disease, children, and older adults should avoid prolonged outdoor exertion.",
             "children": "Children should limit outdoor play and avoid strenuous activities.",
             "elderly": "Elderly should stay indoors and avoid exertion.",
             "asthma": "Asthma patients should avoid outdoor activities. Use medications as prescribed.",
-        }
-        insights["activities"] = {
+        },
+        {
             "walking": {"safe": True, "recommendation": "Short walks are acceptable, but limit time outdoors."},
             "running": {"safe": False, "recommendation": "Avoid running and intense outdoor workouts entirely."},
             "outdoor_play": {"safe": False, "recommendation": "Children should play indoors. Avoid outdoor activities."},
             "cycling": {"safe": False, "recommendation": "Avoid cycling. Use indoor alternatives."},
-        }
-    elif aqi <= 300:
-        insights["health"] = {
+        },
+    ),
+    # Very Unhealthy (201-300)
+    (
+        {
             "general": "Health alert: everyone may experience serious health effects.",
             "sensitive": "High risk for sensitive groups. Stay indoors and keep activity levels low.",
             "children": "Keep children indoors. Avoid all outdoor activities.",
             "elderly": "Elderly must stay indoors and rest. Avoid any exertion.",
             "asthma": "Dangerous for asthma patients. Stay indoors, use air purifiers, and monitor symptoms closely.",
-        }
-        insights["activities"] = {
+        },
+        {
             "walking": {"safe": False, "recommendation": "Avoid all outdoor walking. Stay indoors."},
             "running": {"safe": False, "recommendation": "Do not run outdoors. Dangerous conditions."},
             "outdoor_play": {"safe": False, "recommendation": "Absolutely no outdoor play. Children must stay indoors."},
             "cycling": {"safe": False, "recommendation": "Do not cycle outdoors."},
-        }
-    else:
-        insights["health"] = {
+        },
+    ),
+    # Hazardous (301+)
+    (
+        {
             "general": "Health warnings of emergency conditions. Everyone is at risk.",
             "sensitive": "Extremely dangerous for sensitive groups. Remain indoors and minimize activity.",
             "children": "Keep children indoors with minimal activity. Close all windows.",
             "elderly": "Hazardous conditions. Elderly should remain indoors and rest.",
             "asthma": "Life-threatening for asthma patients. Stay indoors, use air purifiers, and seek medical advice if needed.",
-        }
-        insights["activities"] = {
+        },
+        {
             "walking": {"safe": False, "recommendation": "Hazardous. Do not go outdoors."},
             "running": {"safe": False, "recommendation": "Extremely dangerous. Do not go outdoors."},
             "outdoor_play": {"safe": False, "recommendation": "Emergency conditions. Keep everyone indoors."},
             "cycling": {"safe": False, "recommendation": "Hazardous. Do not go outdoors."},
-        }
+        },
+    ),
+)
+
+
+# Each tier's '"health":{...},"activities":{...}' JSON fragment, serialized once
+_TIER_BYTES = tuple(
+    orjson.dumps({"health": health, "activities": activities})[1:-1]
+    for health, activities in _TIER_PAYLOADS
+)
+
+
+@app.get("/api/insights")
+async def get_insights(
+    request: Request,
+    country: str = Query(..., description="Country code"),
+    city: str = Query(..., description="City name"),
+):
+    summary = await get_city_summary(city, country)
+    if not summary:
+        raise HTTPException(status_code=404, detail=f"City not found: {city}")
+    aqi = summary["aqiIndex"]
+    category = summary["aqiCategory"]
 
-    return insights
+    # Same key order as {"city", "country", "aqi", "category", "health", "activities"}
+    body = b"".join((
+        b'{"city":', orjson.dumps(city),
+        b',"country":', orjson.dumps(country),
+        b',"aqi":', orjson.dumps(aqi, option=orjson.OPT_SERIALIZE_NUMPY),
+        b',"category":', orjson.dumps(category),
+        b",", _TIER_BYTES[bisect.bisect_left(AQI_CATEGORY_LIMITS, aqi)],
+        b"}",
+    ))
+    # The advice text is static but the response carries the current AQI
+    return etag_response_bytes(request, body, CACHE_TTL_LATEST)
 
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # Uvicorn's default "auto" loop/http pick uvloop and httptools when installed
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        workers=int(os.getenv("WEB_CONCURRENCY", 1)),
+    )
@@ -3,12 +3,23 @@ OpenAQ API v3 Client
 Fetches real-time air quality data from OpenAQ API
 """
 import os
-import httpx
-from typing import List, Dict, Any, Optional
+import asyncio
+import bisect
+import aiohttp
+import ijson
+import numpy as np
+import orjson
+from typing import List, Dict, Any, Optional, Tuple, Callable, Awaitable
 from datetime import datetime, timedelta
 import logging
+import time
+from collections import OrderedDict
+from types import MappingProxyType
 from dotenv import load_dotenv
 import pathlib
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+
+from common import get_aqi_category
 
 # Load .env file from backend directory (for local development)
 # In production (Railway), environment variables are provided directly
@@ -25,6 +36,24 @@ OPENAQ_API_BASE = "https://api.openaq.org/v3"
 # Strip whitespace and newlines from API key (common issue with environment variables)
 API_KEY = os.getenv("OPENAQ_API_KEY", "").strip()
 
+# City history merges readings from up to this many stations
+MAX_HISTORY_LOCATIONS = 10
+
+# Cap on concurrent OpenAQ HTTP requests per worker, so a burst of cache misses
+# or a history fanout can't blow through the upstream rate limit and pile up on
+# timeouts
+OPENAQ_CONCURRENCY = int(os.getenv("OPENAQ_CONCURRENCY", "10"))
+_OPENAQ_SEM = asyncio.Semaphore(OPENAQ_CONCURRENCY)
+
+
+def openaq_slots_available() -> int:
+    """Number of OpenAQ request slots currently free (for monitoring)"""
+    return _OPENAQ_SEM._value
+
+# Pollutants reported per city/day, in output order
+POLLUTANTS = ("pm25", "pm10", "no2", "o3", "co", "so2")
+_POLLUTANT_INDEX = {name: i for i, name in enumerate(POLLUTANTS)}
+
 # Fallback to sample data if API fails
 USE_FALLBACK = os.getenv("USE_SAMPLE_DATA", "false").lower() == "true"
 
@@ -40,14 +69,216 @@ else:
     logger.info("USE_SAMPLE_DATA is false - will attempt to use OpenAQ API")
 
 
+# Request headers are fixed for the life of the process. Accept-Encoding is
+# left to aiohttp, which offers br alongside gzip/deflate when brotli is installed
+_HEADERS: Dict[str, str] = {
+    "Accept": "application/json",
+    **({"X-API-Key": API_KEY} if API_KEY else {}),
+}
+
+
 def get_headers() -> Dict[str, str]:
     """Get request headers with API key"""
-    headers = {
-        "Accept": "application/json",
-    }
-    if API_KEY:
-        headers["X-API-Key"] = API_KEY
-    return headers
+    return _HEADERS
+
+
+# Single long-lived session so concurrent requests share pooled keep-alive
+# TCP+TLS connections to OpenAQ instead of handshaking per call
+_session: Optional[aiohttp.ClientSession] = None
+
+
+# Connection pool sizing. aiohttp speaks HTTP/1.1 only, so concurrent
+# requests to OpenAQ each need their own keep-alive connection; size the
+# per-host pool for the per-location fanout rather than relying on multiplexing
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "1000"))
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "100"))
+
+
+def get_session() -> aiohttp.ClientSession:
+    """Get the shared OpenAQ HTTP session, creating it on first use"""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=HTTP_MAX_CONNECTIONS,
+                limit_per_host=HTTP_MAX_CONNECTIONS_PER_HOST,
+                ttl_dns_cache=300,
+                keepalive_timeout=60,
+            ),
+            timeout=aiohttp.ClientTimeout(total=15),
+            headers=_HEADERS,
+        )
+    return _session
+
+
+async def close_session() -> None:
+    """Close the shared OpenAQ HTTP session"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+class OpenAQUnavailable(Exception):
+    """Raised instead of calling OpenAQ while the circuit breaker is open"""
+
+
+class _CircuitBreaker:
+    """Opens after fail_max consecutive failures; lets one trial call through every reset_timeout"""
+    
+    def __init__(self, fail_max: int, reset_timeout: float):
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+    
+    def allow(self) -> bool:
+        if self._opened_at is None:
+            return True
+        now = time.monotonic()
+        if now - self._opened_at < self.reset_timeout:
+            return False
+        # Half-open: this caller is the trial, everyone else waits another window
+        self._opened_at = now
+        return True
+    
+    def record_success(self) -> None:
+        self._failures = 0
+        self._opened_at = None
+    
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._failures >= self.fail_max:
+            if self._opened_at is None:
+                logger.warning(f"OpenAQ circuit opened after {self._failures} consecutive failures")
+            self._opened_at = time.monotonic()
+
+
+# Stop calling OpenAQ for 30s after 5 consecutive failed requests; callers
+# fall back to sample data in the meantime
+_breaker = _CircuitBreaker(fail_max=5, reset_timeout=30)
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    """Transport errors, timeouts, 429 and 5xx are worth retrying; other 4xx are not"""
+    if isinstance(exc, aiohttp.ClientResponseError):
+        return exc.status == 429 or exc.status >= 500
+    return isinstance(exc, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+# Last ETag / Last-Modified seen per request, with the parsed body, so
+# refreshes can be conditional and a 304 reuses the body we already have
+VALIDATOR_CACHE_MAX_ENTRIES = 128
+_validators: "OrderedDict[Tuple[str, Tuple], Tuple[Optional[str], Optional[str], Dict[str, Any]]]" = OrderedDict()
+
+
+@retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential_jitter(initial=0.2, max=2.0, jitter=0.2),
+    retry=retry_if_exception(_is_retryable),
+    reraise=True,
+)
+async def _get_json_with_retry(
+    path: str, params: Dict[str, Any], timeout: Optional[aiohttp.ClientTimeout]
+) -> Dict[str, Any]:
+    session = get_session()
+    cache_key = (path, tuple(sorted((k, str(v)) for k, v in params.items())))
+    cached = _validators.get(cache_key)
+    headers = {}
+    if cached:
+        etag, last_modified, _ = cached
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+    
+    async with session.get(
+        f"{OPENAQ_API_BASE}{path}", params=params, timeout=timeout, headers=headers
+    ) as response:
+        if response.status == 304 and cached:
+            _validators.move_to_end(cache_key)
+            return cached[2]
+        if response.status != 200:
+            error_text = (await response.text())[:500]  # First 500 chars of error
+            logger.warning(f"OpenAQ API error for {path} (params={params}): Status {response.status}, Response: {error_text}")
+        response.raise_for_status()
+        data = orjson.loads(await response.read())
+        
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if etag or last_modified:
+            _validators[cache_key] = (etag, last_modified, data)
+            _validators.move_to_end(cache_key)
+            while len(_validators) > VALIDATOR_CACHE_MAX_ENTRIES:
+                _validators.popitem(last=False)
+        return data
+
+
+def _check_breaker() -> None:
+    """Raise OpenAQUnavailable unless the circuit breaker lets a request through"""
+    if not _breaker.allow():
+        raise OpenAQUnavailable("OpenAQ circuit breaker is open")
+
+
+async def _call_openaq(request: Callable[..., Awaitable[Any]], *args: Any) -> Any:
+    """Run an OpenAQ request coroutine behind the circuit breaker, holding one request slot"""
+    _check_breaker()
+    return await _send_openaq(request, *args)
+
+
+async def _send_openaq(request: Callable[..., Awaitable[Any]], *args: Any) -> Any:
+    """Run an OpenAQ request coroutine (breaker already checked) and record its outcome"""
+    try:
+        async with _OPENAQ_SEM:
+            result = await request(*args)
+    except Exception as e:
+        if _is_retryable(e):
+            _breaker.record_failure()
+        else:
+            # OpenAQ answered (e.g. 4xx for a bad parameter), so it is up
+            _breaker.record_success()
+        raise
+    _breaker.record_success()
+    return result
+
+
+async def _get_json(
+    path: str, params: Dict[str, Any], timeout: Optional[aiohttp.ClientTimeout] = None
+) -> Dict[str, Any]:
+    """GET an OpenAQ endpoint with retries, behind the circuit breaker"""
+    return await _call_openaq(_get_json_with_retry, path, params, timeout)
+
+
+@retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential_jitter(initial=0.2, max=2.0, jitter=0.2),
+    retry=retry_if_exception(_is_retryable),
+    reraise=True,
+)
+async def _get_items_with_retry(
+    path: str, params: Dict[str, Any], prefix: str, parse: Callable[[Dict[str, Any]], Any]
+) -> List[Any]:
+    session = get_session()
+    async with session.get(f"{OPENAQ_API_BASE}{path}", params=params) as response:
+        if response.status != 200:
+            error_text = (await response.text())[:500]  # First 500 chars of error
+            logger.warning(f"OpenAQ API error for {path} (params={params}): Status {response.status}, Response: {error_text}")
+        response.raise_for_status()
+        # Parse items as their bytes arrive and keep only what parse() extracts,
+        # instead of materializing the whole response document
+        rows = []
+        async for item in ijson.items(response.content, prefix, use_float=True):
+            row = parse(item)
+            if row is not None:
+                rows.append(row)
+        return rows
+
+
+async def _get_items(
+    path: str, params: Dict[str, Any], prefix: str, parse: Callable[[Dict[str, Any]], Any]
+) -> List[Any]:
+    """Stream the items at prefix from an OpenAQ endpoint through parse(), dropping Nones"""
+    return await _call_openaq(_get_items_with_retry, path, params, prefix, parse)
 
 
 async def fetch_countries() -> List[Dict[str, Any]]:
@@ -56,74 +287,126 @@ async def fetch_countries() -> List[Dict[str, Any]]:
         return []
     
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(
-                f"{OPENAQ_API_BASE}/countries",
-                headers=get_headers(),
-                params={"limit": 200}
-            )
-            response.raise_for_status()
-            data = response.json()
-            
-            countries = []
-            for country in data.get("results", []):
-                countries.append({
-                    "code": country.get("code", ""),
-                    "name": country.get("name", ""),
-                })
-            return countries
+        data = await _get_json("/countries", {"limit": 200}, timeout=aiohttp.ClientTimeout(total=10))
+        
+        countries = []
+        for country in data.get("results", []):
+            countries.append({
+                "code": country.get("code", ""),
+                "name": country.get("name", ""),
+            })
+        return countries
     except Exception as e:
         logger.error(f"Error fetching countries from OpenAQ: {e}")
         return []
 
 
+# OpenAQ API v3 might accept different names for the country filter; the one
+# that works is remembered after the first successful probe
+_COUNTRY_PARAM_FORMATS = (
+    "countries",  # Format 1: 'countries'
+    "countriesId",  # Format 2: 'countriesId' (camelCase)
+    "countries_id",  # Format 3: 'countries_id' (snake_case)
+)
+_country_param: Optional[str] = None
+# Held while probing, so concurrent cold callers share one probe
+_probe_lock = asyncio.Lock()
+
+# Query parameters shared by every /locations request
+_LOCATIONS_PARAMS = MappingProxyType({"order_by": "lastUpdated", "sort": "desc"})
+
+
+async def _probe_locations(
+    country_code: str, params: Dict[str, Any]
+) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """Try every country filter format at once; (format, data) of the first that succeeds"""
+    # One breaker check for the whole probe, so a half-open trial isn't
+    # cancelled by its siblings being refused
+    _check_breaker()
+    tasks = {
+        asyncio.create_task(
+            _send_openaq(
+                _get_json_with_retry,
+                "/locations",
+                {name: country_code, **params},
+                aiohttp.ClientTimeout(total=10),
+            )
+        ): name
+        for name in _COUNTRY_PARAM_FORMATS
+    }
+    try:
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    return tasks[task], task.result()
+                except Exception as e:
+                    logger.warning(f"Error trying parameter format {tasks[task]}: {e}")
+        return None, None
+    finally:
+        # Cancel the losing probes; consume errors of ones that already finished
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()
+
+
+async def _probe_country_param(
+    country_code: str, params: Dict[str, Any]
+) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """Probe for the country filter format one caller at a time; (format, None) if another caller found it"""
+    global _country_param
+    async with _probe_lock:
+        if _country_param is not None:
+            return _country_param, None
+        _country_param, data = await _probe_locations(country_code, params)
+        return _country_param, data
+
+
 async def fetch_locations(country_code: str, limit: int = 100) -> List[Dict[str, Any]]:
     """Fetch locations (cities/stations) for a country"""
+    global _country_param
     if not API_KEY or USE_FALLBACK:
         return []
     
-    # Try different parameter formats - OpenAQ API v3 might accept different formats
-    param_formats = [
-        {"countries": country_code},  # Format 1: 'countries'
-        {"countriesId": country_code},  # Format 2: 'countriesId' (camelCase)
-        {"countries_id": country_code},  # Format 3: 'countries_id' (snake_case)
-    ]
-    
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        for param_format in param_formats:
+    params = {**_LOCATIONS_PARAMS, "limit": limit}
+    try:
+        data = None
+        # The known format, or a probe for it; once more if that format is rejected
+        for _ in range(2):
+            param = _country_param
+            if param is None:
+                param, data = await _probe_country_param(country_code, params)
+                if data is not None or param is None:
+                    break
             try:
-                params = {
-                    **param_format,
-                    "limit": limit,
-                    "order_by": "lastUpdated",
-                    "sort": "desc"
-                }
-                
-                response = await client.get(
-                    f"{OPENAQ_API_BASE}/locations",
-                    headers=get_headers(),
-                    params=params
+                data = await _get_json(
+                    "/locations", {param: country_code, **params}, timeout=aiohttp.ClientTimeout(total=10)
                 )
-                
-                # If successful, process the data
-                if response.status_code == 200:
-                    data = response.json()
-                    break
-                else:
-                    # Log error but try next format
-                    error_text = response.text[:500]
-                    logger.warning(f"OpenAQ API error for locations (country={country_code}, format={list(param_format.keys())[0]}): Status {response.status_code}, Response: {error_text}")
-                    continue
+                break
+            except OpenAQUnavailable:
+                raise
             except Exception as e:
-                logger.warning(f"Error trying parameter format {list(param_format.keys())[0]}: {e}")
-                continue
-        else:
-            # All formats failed
-            logger.error(f"All parameter formats failed for country {country_code}")
-            return []
+                if _is_retryable(e):
+                    # OpenAQ is failing, not rejecting the format - keep it
+                    logger.error(f"Error fetching locations for {country_code}: {e}")
+                    return []
+                logger.warning(f"Parameter format {param} rejected: {e}")
+                if _country_param == param:
+                    _country_param = None
+    except OpenAQUnavailable:
+        logger.warning(f"Skipping locations for {country_code}: OpenAQ circuit breaker is open")
+        return []
+    if data is None:
+        # All formats failed
+        logger.error(f"All parameter formats failed for country {country_code}")
+        return []
     
     try:
         locations = []
+        now_iso = datetime.now().isoformat()
         for loc in data.get("results", []):
             # Use the location's city field if available, otherwise extract from name
             city_name = loc.get("city") or loc.get("name", "").split(",")[0].strip()
@@ -150,13 +433,8 @@ async def fetch_locations(country_code: str, limit: int = 100) -> List[Dict[str,
                 "name": loc.get("name", ""),
                 "lat": lat,
                 "lon": lon,
-                "pm25": measurements.get("pm25", 0),
-                "pm10": measurements.get("pm10", 0),
-                "no2": measurements.get("no2", 0),
-                "o3": measurements.get("o3", 0),
-                "co": measurements.get("co", 0),
-                "so2": measurements.get("so2", 0),
-                "lastUpdated": loc.get("lastUpdated") or loc.get("last_updated") or datetime.now().isoformat(),
+                **{name: measurements.get(name, 0) for name in POLLUTANTS},
+                "lastUpdated": loc.get("lastUpdated") or loc.get("last_updated") or now_iso,
             })
         
         return locations
@@ -165,217 +443,264 @@ async def fetch_locations(country_code: str, limit: int = 100) -> List[Dict[str,
         return []
 
 
+def _parse_measurement(measurement: Dict[str, Any]) -> Optional[Tuple[str, Optional[int], Any]]:
+    """(date, pollutant index, value) of one measurement, or None if it has no usable date"""
+    # OpenAQ API v3 might use different date field structures
+    date_str = None
+    date_obj = measurement.get("date", {})
+    if isinstance(date_obj, dict):
+        date_str = date_obj.get("utc") or date_obj.get("local")
+    elif isinstance(date_obj, str):
+        date_str = date_obj
+    else:
+        # Try datetime field directly
+        date_str = measurement.get("datetime") or measurement.get("dateTime")
+    
+    if not date_str:
+        return None
+    
+    # Extract date (YYYY-MM-DD) - ISO 8601 timestamps start with it
+    if not isinstance(date_str, str):
+        return None
+    date_key = date_str[:10]
+    if len(date_key) != 10 or date_key[4] != "-" or date_key[7] != "-":
+        logger.debug(f"Error parsing date {date_str}")
+        return None
+    
+    # Get parameter name - could be nested or direct
+    param_obj = measurement.get("parameter", {})
+    if isinstance(param_obj, dict):
+        param_name = param_obj.get("name", "").lower()
+    else:
+        param_name = str(param_obj).lower()
+    
+    return date_key, _POLLUTANT_INDEX.get(param_name), measurement.get("value", 0)
+
+
+async def _fetch_measurements_for_location(params: Dict[str, Any]) -> List[Tuple[str, Optional[int], Any]]:
+    """Parsed measurements for one /measurements query"""
+    return await _get_items("/measurements", params, "results.item", _parse_measurement)
+
+
 async def fetch_measurements(
     location_id: Optional[str] = None,
     city: Optional[str] = None,
     country_code: Optional[str] = None,
-    days: int = 30
+    days: int = 30,
+    locations_by_city_lower: Optional[Dict[str, List[Dict[str, Any]]]] = None,
 ) -> List[Dict[str, Any]]:
-    """Fetch historical measurements"""
+    """Fetch historical measurements (pass the country's grouped locations if already known)"""
     if not API_KEY or USE_FALLBACK:
         return []
     
     try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            # Calculate date range - OpenAQ API v3 expects ISO 8601 format with timezone
-            end_date = datetime.utcnow()
-            start_date = end_date - timedelta(days=days)
-            
-            # Format dates as ISO 8601 with 'Z' suffix for UTC
-            params = {
-                "date_from": start_date.strftime("%Y-%m-%dT%H:%M:%SZ"),
-                "date_to": end_date.strftime("%Y-%m-%dT%H:%M:%SZ"),
-                "limit": 1000,
-                "order_by": "datetime",
-                "sort": "asc"
-            }
-            
-            if location_id:
-                params["locations"] = location_id  # Try 'locations' instead of 'locations_id'
-            elif city and country_code:
-                # We'll need to find location IDs first
-                locations = await fetch_locations(country_code, limit=200)
-                matching_locs = [loc for loc in locations if city.lower() in loc.get("city", "").lower()]
-                if matching_locs:
-                    params["locations"] = matching_locs[0].get("id")
-                elif country_code:
-                    # If no matching city, try filtering by country
-                    params["countries"] = country_code
-            
-            response = await client.get(
-                f"{OPENAQ_API_BASE}/measurements",
-                headers=get_headers(),
-                params=params
-            )
-            
-            # Log error details if request fails
-            if response.status_code != 200:
-                error_text = response.text[:500]  # First 500 chars of error
-                logger.error(f"OpenAQ API error for measurements: Status {response.status_code}, Response: {error_text}")
-            
-            response.raise_for_status()
-            data = response.json()
-            
-            # Group measurements by date
-            measurements_by_date: Dict[str, Dict[str, Any]] = {}
-            
-            for measurement in data.get("results", []):
-                # OpenAQ API v3 might use different date field structures
-                date_str = None
-                date_obj = measurement.get("date", {})
-                if isinstance(date_obj, dict):
-                    date_str = date_obj.get("utc") or date_obj.get("local")
-                elif isinstance(date_obj, str):
-                    date_str = date_obj
-                else:
-                    # Try datetime field directly
-                    date_str = measurement.get("datetime") or measurement.get("dateTime")
-                
-                if not date_str:
-                    continue
-                
-                # Extract date (YYYY-MM-DD)
-                try:
-                    # Handle different date formats
-                    if isinstance(date_str, str):
-                        # Remove timezone info and parse
-                        date_str_clean = date_str.replace("Z", "+00:00").split("+")[0].split("T")[0]
-                        if len(date_str_clean) == 10:  # YYYY-MM-DD format
-                            date_key = date_str_clean
-                        else:
-                            date_obj_parsed = datetime.fromisoformat(date_str.replace("Z", "+00:00"))
-                            date_key = date_obj_parsed.strftime("%Y-%m-%d")
-                    else:
-                        continue
-                except Exception as e:
-                    logger.debug(f"Error parsing date {date_str}: {e}")
+        # Calculate date range - OpenAQ API v3 expects ISO 8601 format with timezone
+        end_date = datetime.utcnow()
+        start_date = end_date - timedelta(days=days)
+        
+        # Format dates as ISO 8601 with 'Z' suffix for UTC
+        params = {
+            "date_from": start_date.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "date_to": end_date.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "limit": 1000,
+            "order_by": "datetime",
+            "sort": "asc"
+        }
+        
+        # One request per location to query
+        request_params = [params]
+        if location_id:
+            params["locations"] = location_id  # Try 'locations' instead of 'locations_id'
+        elif city and country_code:
+            # We'll need to find location IDs first
+            if locations_by_city_lower is None:
+                _, _, locations_by_city_lower = await aggregate_city_data(
+                    await fetch_locations(country_code, limit=200)
+                )
+            matching_locs = match_city_locations(locations_by_city_lower, city)
+            if matching_locs:
+                request_params = [
+                    {**params, "locations": loc.get("id")}
+                    for loc in matching_locs[:MAX_HISTORY_LOCATIONS]
+                ]
+            elif country_code:
+                # If no matching city, try filtering by country
+                params["countries"] = country_code
+        
+        # Query the city's stations concurrently and merge their readings; a
+        # station that fails only drops its own readings. OPENAQ_CONCURRENCY
+        # bounds how many of these are in flight.
+        results_per_location = await asyncio.gather(
+            *(_fetch_measurements_for_location(p) for p in request_params),
+            return_exceptions=True,
+        )
+        
+        # Collect (date, pollutant, value) triples; per-day means are computed in one
+        # vectorized pass afterwards
+        all_dates: List[str] = []
+        value_dates: List[str] = []
+        value_params: List[int] = []
+        values: List[float] = []
+        
+        for location_params, rows in zip(request_params, results_per_location):
+            if isinstance(rows, Exception):
+                logger.warning(f"Error fetching measurements for location {location_params.get('locations')}: {rows}")
+                continue
+            for date_key, param_idx, value in rows:
+                all_dates.append(date_key)
+                if param_idx is None or value is None:
                     continue
-                
-                if date_key not in measurements_by_date:
-                    measurements_by_date[date_key] = {
-                        "date": date_key,
-                        "pm25": None,
-                        "pm10": None,
-                        "no2": None,
-                        "o3": None,
-                        "co": None,
-                        "so2": None,
-                    }
-                
-                # Get parameter name - could be nested or direct
-                param_obj = measurement.get("parameter", {})
-                if isinstance(param_obj, dict):
-                    param_name = param_obj.get("name", "").lower()
-                else:
-                    param_name = str(param_obj).lower()
-                
-                value = measurement.get("value", 0)
-                
-                if param_name in measurements_by_date[date_key]:
-                    # Use average if multiple values per day
-                    current = measurements_by_date[date_key][param_name]
-                    if current is None:
-                        measurements_by_date[date_key][param_name] = value
-                    else:
-                        measurements_by_date[date_key][param_name] = (current + value) / 2
-            
-            # Convert to list and calculate AQI
-            history = []
-            for date_key in sorted(measurements_by_date.keys()):
-                day_data = measurements_by_date[date_key]
-                # Calculate AQI from PM2.5 (simplified)
-                pm25 = day_data.get("pm25", 0) or 0
-                aqi = calculate_aqi_from_pm25(pm25)
-                day_data["aqiIndex"] = aqi
-                history.append(day_data)
-            
-            return history
+                value_dates.append(date_key)
+                value_params.append(param_idx)
+                values.append(value)
+        
+        if not all_dates:
+            return []
+        
+        # Mean per (date, pollutant): factorize dates, then sum and count with bincount
+        dates = np.unique(np.array(all_dates))
+        n_cells = len(dates) * len(POLLUTANTS)
+        cell = np.searchsorted(dates, np.array(value_dates, dtype=dates.dtype)) * len(POLLUTANTS)
+        cell += np.array(value_params, dtype=np.int64)
+        sums = np.bincount(cell, weights=np.array(values, dtype=np.float64), minlength=n_cells)
+        counts = np.bincount(cell, minlength=n_cells)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = (sums / counts).reshape(len(dates), len(POLLUTANTS))
+        has_value = (counts > 0).reshape(len(dates), len(POLLUTANTS))
+        
+        # Calculate AQI from PM2.5 (simplified) for every day at once; days
+        # without PM2.5 readings count as 0
+        pm25_col = _POLLUTANT_INDEX["pm25"]
+        daily_pm25 = np.where(has_value[:, pm25_col], means[:, pm25_col], 0.0)
+        aqis = calculate_aqi_from_pm25_batch(daily_pm25).tolist()
+        
+        # Convert to list
+        history = []
+        for date_key, day_means, day_has, aqi in zip(dates.tolist(), means.tolist(), has_value.tolist(), aqis):
+            day_data: Dict[str, Any] = {"date": date_key}
+            for param_name, mean, present in zip(POLLUTANTS, day_means, day_has):
+                day_data[param_name] = mean if present else None
+            day_data["aqiIndex"] = aqi
+            history.append(day_data)
+        
+        return history
     except Exception as e:
         logger.error(f"Error fetching measurements: {e}")
         return []
 
 
+# EPA PM2.5 -> AQI piecewise-linear segments: segment i covers
+# (_PM25_SEGMENT_LOW[i], _PM25_SEGMENT_TOPS[i]] and maps it onto
+# _AQI_SEGMENT_LOW[i] + slope * (pm25 - low). The last segment is open-ended
+# and extrapolated past 500.4.
+_PM25_SEGMENT_TOPS = (12, 35.4, 55.4, 150.4, 250.4)
+_PM25_SEGMENT_LOW = (0, 12, 35.4, 55.4, 150.4, 250.4)
+_AQI_SEGMENT_LOW = (0, 50, 100, 150, 200, 300)
+_AQI_SEGMENT_SLOPE = (
+    50 / 12,
+    (100 - 50) / (35.4 - 12),
+    (150 - 100) / (55.4 - 35.4),
+    (200 - 150) / (150.4 - 55.4),
+    (300 - 200) / (250.4 - 150.4),
+    (400 - 300) / (500.4 - 250.4),
+)
+# Array copies for the vectorized version
+_PM25_SEGMENT_TOPS_ARR = np.array(_PM25_SEGMENT_TOPS, dtype=np.float64)
+_PM25_SEGMENT_LOW_ARR = np.array(_PM25_SEGMENT_LOW, dtype=np.float64)
+_AQI_SEGMENT_LOW_ARR = np.array(_AQI_SEGMENT_LOW, dtype=np.float64)
+_AQI_SEGMENT_SLOPE_ARR = np.array(_AQI_SEGMENT_SLOPE, dtype=np.float64)
+
+
 def calculate_aqi_from_pm25(pm25: float) -> int:
     """Calculate AQI from PM2.5 value (US EPA standard)"""
-    if pm25 <= 12:
-        return int((50 / 12) * pm25)
-    elif pm25 <= 35.4:
-        return int(50 + ((100 - 50) / (35.4 - 12)) * (pm25 - 12))
-    elif pm25 <= 55.4:
-        return int(100 + ((150 - 100) / (55.4 - 35.4)) * (pm25 - 35.4))
-    elif pm25 <= 150.4:
-        return int(150 + ((200 - 150) / (150.4 - 55.4)) * (pm25 - 55.4))
-    elif pm25 <= 250.4:
-        return int(200 + ((300 - 200) / (250.4 - 150.4)) * (pm25 - 150.4))
-    else:
-        return int(300 + ((400 - 300) / (500.4 - 250.4)) * (pm25 - 250.4))
-
-
-def get_aqi_category(aqi: int) -> str:
-    """Get AQI category from AQI index"""
-    if aqi <= 50:
-        return "Good"
-    elif aqi <= 100:
-        return "Moderate"
-    elif aqi <= 150:
-        return "Unhealthy for Sensitive Groups"
-    elif aqi <= 200:
-        return "Unhealthy"
-    elif aqi <= 300:
-        return "Very Unhealthy"
-    else:
-        return "Hazardous"
+    seg = bisect.bisect_left(_PM25_SEGMENT_TOPS, pm25)
+    return int(_AQI_SEGMENT_LOW[seg] + _AQI_SEGMENT_SLOPE[seg] * (pm25 - _PM25_SEGMENT_LOW[seg]))
 
 
-async def aggregate_city_data(locations: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
-    """Aggregate location data by city"""
-    cities: Dict[str, Dict[str, Any]] = {}
-    
-    for loc in locations:
+def calculate_aqi_from_pm25_batch(pm25: np.ndarray) -> np.ndarray:
+    """Calculate AQI for an array of PM2.5 values (matches calculate_aqi_from_pm25)"""
+    pm25 = np.asarray(pm25, dtype=np.float64)
+    # Index of the first segment whose top is >= the value
+    seg = np.searchsorted(_PM25_SEGMENT_TOPS_ARR, pm25, side="left")
+    aqi = _AQI_SEGMENT_LOW_ARR[seg] + _AQI_SEGMENT_SLOPE_ARR[seg] * (pm25 - _PM25_SEGMENT_LOW_ARR[seg])
+    return aqi.astype(np.int64)
+
+
+def match_city_locations(
+    locations_by_city_lower: Dict[str, List[Dict[str, Any]]], city: str
+) -> List[Dict[str, Any]]:
+    """Locations whose city name contains city (case-insensitive), exact name first.
+
+    The one city matching rule for stations and history, so "Delhi" covers
+    "New Delhi" in both.
+    """
+    city_lower = city.lower()
+    matches = list(locations_by_city_lower.get(city_lower, []))
+    for name, locs in locations_by_city_lower.items():
+        if name != city_lower and city_lower in name:
+            matches.extend(locs)
+    return matches
+
+
+async def aggregate_city_data(
+    locations: List[Dict[str, Any]],
+) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, str], Dict[str, List[Dict[str, Any]]]]:
+    """Aggregate location data by city.
+
+    Returns (city_data, lower_index, locations_by_city_lower): the per-city
+    averages keyed by city name, a lowercase -> canonical city name index, and
+    the raw locations grouped by lowercase city name.
+    """
+    # Group locations by city (first-seen order) and lay their pollutant
+    # readings out as one (locations x pollutants) matrix
+    city_names: List[str] = []
+    city_first_loc: List[Dict[str, Any]] = []
+    city_locations: List[List[Dict[str, Any]]] = []
+    city_index: Dict[str, int] = {}
+    loc_city = np.empty(len(locations), dtype=np.int64)
+    rows = []
+    for i, loc in enumerate(locations):
         city_name = loc.get("city", "Unknown")
-        
-        if city_name not in cities:
-            cities[city_name] = {
-                "city": city_name,
-                "pm25": [],
-                "pm10": [],
-                "no2": [],
-                "o3": [],
-                "co": [],
-                "so2": [],
-                "lat": loc.get("lat", 0),
-                "lon": loc.get("lon", 0),
-                "locations": [],
-            }
-        
-        # Collect measurements from all locations in the city
-        if loc.get("pm25", 0) > 0:
-            cities[city_name]["pm25"].append(loc["pm25"])
-        if loc.get("pm10", 0) > 0:
-            cities[city_name]["pm10"].append(loc["pm10"])
-        if loc.get("no2", 0) > 0:
-            cities[city_name]["no2"].append(loc["no2"])
-        if loc.get("o3", 0) > 0:
-            cities[city_name]["o3"].append(loc["o3"])
-        if loc.get("co", 0) > 0:
-            cities[city_name]["co"].append(loc["co"])
-        if loc.get("so2", 0) > 0:
-            cities[city_name]["so2"].append(loc["so2"])
-        
-        cities[city_name]["locations"].append(loc)
+        idx = city_index.get(city_name)
+        if idx is None:
+            idx = city_index[city_name] = len(city_names)
+            city_names.append(city_name)
+            city_first_loc.append(loc)
+            city_locations.append([])
+        city_locations[idx].append(loc)
+        loc_city[i] = idx
+        rows.append([loc.get(p, 0) for p in POLLUTANTS])
+    
+    # Per-city mean of each pollutant over the locations reporting a positive value
+    n_cities = len(city_names)
+    readings = np.array(rows, dtype=np.float64).reshape(len(locations), len(POLLUTANTS))
+    valid = readings > 0
+    positive = np.where(valid, readings, 0.0)
+    sums = np.empty((n_cities, len(POLLUTANTS)))
+    counts = np.empty((n_cities, len(POLLUTANTS)))
+    for col in range(len(POLLUTANTS)):
+        sums[:, col] = np.bincount(loc_city, weights=positive[:, col], minlength=n_cities)
+        counts[:, col] = np.bincount(loc_city, weights=valid[:, col], minlength=n_cities)
+    means = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+    
+    # AQI for every city in one vectorized call
+    aqis = calculate_aqi_from_pm25_batch(means[:, _POLLUTANT_INDEX["pm25"]]).tolist()
     
-    # Calculate averages for each city
     result = {}
-    for city_name, data in cities.items():
-        pm25 = sum(data["pm25"]) / len(data["pm25"]) if data["pm25"] else 0
-        pm10 = sum(data["pm10"]) / len(data["pm10"]) if data["pm10"] else 0
-        no2 = sum(data["no2"]) / len(data["no2"]) if data["no2"] else 0
-        o3 = sum(data["o3"]) / len(data["o3"]) if data["o3"] else 0
-        co = sum(data["co"]) / len(data["co"]) if data["co"] else 0
-        so2 = sum(data["so2"]) / len(data["so2"]) if data["so2"] else 0
-        
-        aqi = calculate_aqi_from_pm25(pm25)
+    lower_index: Dict[str, str] = {}
+    locations_by_city_lower: Dict[str, List[Dict[str, Any]]] = {}
+    now_iso = datetime.now().isoformat()
+    for city_name, first_loc, locs, city_means, city_has, aqi in zip(
+        city_names, city_first_loc, city_locations, means.tolist(), (counts > 0).tolist(), aqis
+    ):
+        city_lower = city_name.lower()
+        lower_index.setdefault(city_lower, city_name)
+        locations_by_city_lower.setdefault(city_lower, []).extend(locs)
         
+        # Cities with no readings for a pollutant report 0
+        pm25, pm10, no2, o3, co, so2 = (
+            mean if has else 0 for mean, has in zip(city_means, city_has)
+        )
         result[city_name] = {
             "city": city_name,
             "aqiIndex": aqi,
@@ -386,11 +711,10 @@ async def aggregate_city_data(locations: List[Dict[str, Any]]) -> Dict[str, Dict
             "o3": round(o3, 1),
             "co": round(co, 2),
             "so2": round(so2, 1),
-            "lat": data["lat"],
-            "lon": data["lon"],
+            "lat": first_loc.get("lat", 0),
+            "lon": first_loc.get("lon", 0),
             "population": 0,  # OpenAQ doesn't provide population
-            "lastUpdated": datetime.now().isoformat(),
+            "lastUpdated": now_iso,
         }
     
-    return result
-
+    return result, lower_index, locations_by_city_lower
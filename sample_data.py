@@ -1,7 +1,12 @@
+from dataclasses import asdict, dataclass
 from datetime import datetime, timedelta
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 import random
 
+import numpy as np
+
+from common import get_aqi_category
+
 SAMPLE_COUNTRIES = [
     {"code": "IN", "name": "India"},
     {"code": "US", "name": "United States"},
@@ -13,348 +18,398 @@ SAMPLE_COUNTRIES = [
     {"code": "AU", "name": "Australia"},
 ]
 
-SAMPLE_CITIES = {
+
+@dataclass(frozen=True, slots=True)
+class SampleCity:
+    """Static sample readings for one city (shared - never mutated)"""
+    city: str
+    aqiIndex: int
+    aqiCategory: str
+    pm25: float
+    pm10: float
+    no2: float
+    o3: float
+    co: float
+    so2: float
+    population: int
+    lat: float
+    lon: float
+
+
+SAMPLE_CITIES: Dict[str, List[SampleCity]] = {
     "IN": [
-        {
-            "city": "New Delhi",
-            "aqiIndex": 280,
-            "aqiCategory": "Very Unhealthy",
-            "pm25": 180,
-            "pm10": 260,
-            "no2": 90,
-            "o3": 35,
-            "co": 1.2,
-            "so2": 22,
-            "population": 32000000,
-            "lat": 28.7041,
-            "lon": 77.1025,
-        },
-        {
-            "city": "Mumbai",
-            "aqiIndex": 160,
-            "aqiCategory": "Unhealthy",
-            "pm25": 95,
-            "pm10": 140,
-            "no2": 60,
-            "o3": 40,
-            "co": 0.9,
-            "so2": 15,
-            "population": 20000000,
-            "lat": 19.0760,
-            "lon": 72.8777,
-        },
-        {
-            "city": "Bangalore",
-            "aqiIndex": 120,
-            "aqiCategory": "Unhealthy for Sensitive Groups",
-            "pm25": 65,
-            "pm10": 95,
-            "no2": 45,
-            "o3": 38,
-            "co": 0.7,
-            "so2": 12,
-            "population": 12000000,
-            "lat": 12.9716,
-            "lon": 77.5946,
-        },
-        {
-            "city": "Kolkata",
-            "aqiIndex": 185,
-            "aqiCategory": "Unhealthy",
-            "pm25": 110,
-            "pm10": 165,
-            "no2": 72,
-            "o3": 42,
-            "co": 1.0,
-            "so2": 18,
-            "population": 14800000,
-            "lat": 22.5726,
-            "lon": 88.3639,
-        },
-        {
-            "city": "Chennai",
-            "aqiIndex": 95,
-            "aqiCategory": "Moderate",
-            "pm25": 48,
-            "pm10": 78,
-            "no2": 38,
-            "o3": 45,
-            "co": 0.6,
-            "so2": 10,
-            "population": 10900000,
-            "lat": 13.0827,
-            "lon": 80.2707,
-        },
+        SampleCity(
+            city="New Delhi",
+            aqiIndex=280,
+            aqiCategory="Very Unhealthy",
+            pm25=180,
+            pm10=260,
+            no2=90,
+            o3=35,
+            co=1.2,
+            so2=22,
+            population=32000000,
+            lat=28.7041,
+            lon=77.1025,
+        ),
+        SampleCity(
+            city="Mumbai",
+            aqiIndex=160,
+            aqiCategory="Unhealthy",
+            pm25=95,
+            pm10=140,
+            no2=60,
+            o3=40,
+            co=0.9,
+            so2=15,
+            population=20000000,
+            lat=19.0760,
+            lon=72.8777,
+        ),
+        SampleCity(
+            city="Bangalore",
+            aqiIndex=120,
+            aqiCategory="Unhealthy for Sensitive Groups",
+            pm25=65,
+            pm10=95,
+            no2=45,
+            o3=38,
+            co=0.7,
+            so2=12,
+            population=12000000,
+            lat=12.9716,
+            lon=77.5946,
+        ),
+        SampleCity(
+            city="Kolkata",
+            aqiIndex=185,
+            aqiCategory="Unhealthy",
+            pm25=110,
+            pm10=165,
+            no2=72,
+            o3=42,
+            co=1.0,
+            so2=18,
+            population=14800000,
+            lat=22.5726,
+            lon=88.3639,
+        ),
+        SampleCity(
+            city="Chennai",
+            aqiIndex=95,
+            aqiCategory="Moderate",
+            pm25=48,
+            pm10=78,
+            no2=38,
+            o3=45,
+            co=0.6,
+            so2=10,
+            population=10900000,
+            lat=13.0827,
+            lon=80.2707,
+        ),
     ],
     "US": [
-        {
-            "city": "Los Angeles",
-            "aqiIndex": 75,
-            "aqiCategory": "Moderate",
-            "pm25": 35,
-            "pm10": 58,
-            "no2": 42,
-            "o3": 55,
-            "co": 0.5,
-            "so2": 8,
-            "population": 13000000,
-            "lat": 34.0522,
-            "lon": -118.2437,
-        },
-        {
-            "city": "New York",
-            "aqiIndex": 55,
-            "aqiCategory": "Moderate",
-            "pm25": 28,
-            "pm10": 45,
-            "no2": 38,
-            "o3": 48,
-            "co": 0.4,
-            "so2": 7,
-            "population": 19000000,
-            "lat": 40.7128,
-            "lon": -74.0060,
-        },
-        {
-            "city": "Chicago",
-            "aqiIndex": 48,
-            "aqiCategory": "Good",
-            "pm25": 22,
-            "pm10": 38,
-            "no2": 32,
-            "o3": 42,
-            "co": 0.3,
-            "so2": 6,
-            "population": 9500000,
-            "lat": 41.8781,
-            "lon": -87.6298,
-        },
+        SampleCity(
+            city="Los Angeles",
+            aqiIndex=75,
+            aqiCategory="Moderate",
+            pm25=35,
+            pm10=58,
+            no2=42,
+            o3=55,
+            co=0.5,
+            so2=8,
+            population=13000000,
+            lat=34.0522,
+            lon=-118.2437,
+        ),
+        SampleCity(
+            city="New York",
+            aqiIndex=55,
+            aqiCategory="Moderate",
+            pm25=28,
+            pm10=45,
+            no2=38,
+            o3=48,
+            co=0.4,
+            so2=7,
+            population=19000000,
+            lat=40.7128,
+            lon=-74.0060,
+        ),
+        SampleCity(
+            city="Chicago",
+            aqiIndex=48,
+            aqiCategory="Good",
+            pm25=22,
+            pm10=38,
+            no2=32,
+            o3=42,
+            co=0.3,
+            so2=6,
+            population=9500000,
+            lat=41.8781,
+            lon=-87.6298,
+        ),
     ],
     "GB": [
-        {
-            "city": "London",
-            "aqiIndex": 62,
-            "aqiCategory": "Moderate",
-            "pm25": 32,
-            "pm10": 52,
-            "no2": 45,
-            "o3": 38,
-            "co": 0.4,
-            "so2": 9,
-            "population": 9000000,
-            "lat": 51.5074,
-            "lon": -0.1278,
-        },
-        {
-            "city": "Manchester",
-            "aqiIndex": 58,
-            "aqiCategory": "Moderate",
-            "pm25": 29,
-            "pm10": 48,
-            "no2": 40,
-            "o3": 35,
-            "co": 0.35,
-            "so2": 8,
-            "population": 2800000,
-            "lat": 53.4808,
-            "lon": -2.2426,
-        },
+        SampleCity(
+            city="London",
+            aqiIndex=62,
+            aqiCategory="Moderate",
+            pm25=32,
+            pm10=52,
+            no2=45,
+            o3=38,
+            co=0.4,
+            so2=9,
+            population=9000000,
+            lat=51.5074,
+            lon=-0.1278,
+        ),
+        SampleCity(
+            city="Manchester",
+            aqiIndex=58,
+            aqiCategory="Moderate",
+            pm25=29,
+            pm10=48,
+            no2=40,
+            o3=35,
+            co=0.35,
+            so2=8,
+            population=2800000,
+            lat=53.4808,
+            lon=-2.2426,
+        ),
     ],
     "DE": [
-        {
-            "city": "Berlin",
-            "aqiIndex": 45,
-            "aqiCategory": "Good",
-            "pm25": 20,
-            "pm10": 35,
-            "no2": 32,
-            "o3": 40,
-            "co": 0.3,
-            "so2": 6,
-            "population": 3800000,
-            "lat": 52.5200,
-            "lon": 13.4050,
-        },
-        {
-            "city": "Munich",
-            "aqiIndex": 42,
-            "aqiCategory": "Good",
-            "pm25": 18,
-            "pm10": 32,
-            "no2": 28,
-            "o3": 38,
-            "co": 0.28,
-            "so2": 5,
-            "population": 1500000,
-            "lat": 48.1351,
-            "lon": 11.5820,
-        },
+        SampleCity(
+            city="Berlin",
+            aqiIndex=45,
+            aqiCategory="Good",
+            pm25=20,
+            pm10=35,
+            no2=32,
+            o3=40,
+            co=0.3,
+            so2=6,
+            population=3800000,
+            lat=52.5200,
+            lon=13.4050,
+        ),
+        SampleCity(
+            city="Munich",
+            aqiIndex=42,
+            aqiCategory="Good",
+            pm25=18,
+            pm10=32,
+            no2=28,
+            o3=38,
+            co=0.28,
+            so2=5,
+            population=1500000,
+            lat=48.1351,
+            lon=11.5820,
+        ),
     ],
     "BR": [
-        {
-            "city": "São Paulo",
-            "aqiIndex": 88,
-            "aqiCategory": "Moderate",
-            "pm25": 42,
-            "pm10": 68,
-            "no2": 52,
-            "o3": 45,
-            "co": 0.65,
-            "so2": 12,
-            "population": 22000000,
-            "lat": -23.5505,
-            "lon": -46.6333,
-        },
-        {
-            "city": "Rio de Janeiro",
-            "aqiIndex": 72,
-            "aqiCategory": "Moderate",
-            "pm25": 36,
-            "pm10": 58,
-            "no2": 45,
-            "o3": 50,
-            "co": 0.55,
-            "so2": 10,
-            "population": 13000000,
-            "lat": -22.9068,
-            "lon": -43.1729,
-        },
+        SampleCity(
+            city="São Paulo",
+            aqiIndex=88,
+            aqiCategory="Moderate",
+            pm25=42,
+            pm10=68,
+            no2=52,
+            o3=45,
+            co=0.65,
+            so2=12,
+            population=22000000,
+            lat=-23.5505,
+            lon=-46.6333,
+        ),
+        SampleCity(
+            city="Rio de Janeiro",
+            aqiIndex=72,
+            aqiCategory="Moderate",
+            pm25=36,
+            pm10=58,
+            no2=45,
+            o3=50,
+            co=0.55,
+            so2=10,
+            population=13000000,
+            lat=-22.9068,
+            lon=-43.1729,
+        ),
     ],
     "CN": [
-        {
-            "city": "Beijing",
-            "aqiIndex": 165,
-            "aqiCategory": "Unhealthy",
-            "pm25": 98,
-            "pm10": 145,
-            "no2": 68,
-            "o3": 42,
-            "co": 0.95,
-            "so2": 20,
-            "population": 21500000,
-            "lat": 39.9042,
-            "lon": 116.4074,
-        },
-        {
-            "city": "Shanghai",
-            "aqiIndex": 135,
-            "aqiCategory": "Unhealthy for Sensitive Groups",
-            "pm25": 78,
-            "pm10": 115,
-            "no2": 58,
-            "o3": 48,
-            "co": 0.82,
-            "so2": 16,
-            "population": 27000000,
-            "lat": 31.2304,
-            "lon": 121.4737,
-        },
+        SampleCity(
+            city="Beijing",
+            aqiIndex=165,
+            aqiCategory="Unhealthy",
+            pm25=98,
+            pm10=145,
+            no2=68,
+            o3=42,
+            co=0.95,
+            so2=20,
+            population=21500000,
+            lat=39.9042,
+            lon=116.4074,
+        ),
+        SampleCity(
+            city="Shanghai",
+            aqiIndex=135,
+            aqiCategory="Unhealthy for Sensitive Groups",
+            pm25=78,
+            pm10=115,
+            no2=58,
+            o3=48,
+            co=0.82,
+            so2=16,
+            population=27000000,
+            lat=31.2304,
+            lon=121.4737,
+        ),
     ],
     "JP": [
-        {
-            "city": "Tokyo",
-            "aqiIndex": 52,
-            "aqiCategory": "Moderate",
-            "pm25": 26,
-            "pm10": 42,
-            "no2": 36,
-            "o3": 45,
-            "co": 0.38,
-            "so2": 7,
-            "population": 37000000,
-            "lat": 35.6762,
-            "lon": 139.6503,
-        },
-        {
-            "city": "Osaka",
-            "aqiIndex": 48,
-            "aqiCategory": "Good",
-            "pm25": 23,
-            "pm10": 38,
-            "no2": 32,
-            "o3": 42,
-            "co": 0.35,
-            "so2": 6,
-            "population": 19000000,
-            "lat": 34.6937,
-            "lon": 135.5023,
-        },
+        SampleCity(
+            city="Tokyo",
+            aqiIndex=52,
+            aqiCategory="Moderate",
+            pm25=26,
+            pm10=42,
+            no2=36,
+            o3=45,
+            co=0.38,
+            so2=7,
+            population=37000000,
+            lat=35.6762,
+            lon=139.6503,
+        ),
+        SampleCity(
+            city="Osaka",
+            aqiIndex=48,
+            aqiCategory="Good",
+            pm25=23,
+            pm10=38,
+            no2=32,
+            o3=42,
+            co=0.35,
+            so2=6,
+            population=19000000,
+            lat=34.6937,
+            lon=135.5023,
+        ),
     ],
     "AU": [
-        {
-            "city": "Sydney",
-            "aqiIndex": 38,
-            "aqiCategory": "Good",
-            "pm25": 15,
-            "pm10": 28,
-            "no2": 25,
-            "o3": 38,
-            "co": 0.25,
-            "so2": 4,
-            "population": 5300000,
-            "lat": -33.8688,
-            "lon": 151.2093,
-        },
-        {
-            "city": "Melbourne",
-            "aqiIndex": 35,
-            "aqiCategory": "Good",
-            "pm25": 14,
-            "pm10": 25,
-            "no2": 22,
-            "o3": 35,
-            "co": 0.22,
-            "so2": 3,
-            "population": 5000000,
-            "lat": -37.8136,
-            "lon": 144.9631,
-        },
+        SampleCity(
+            city="Sydney",
+            aqiIndex=38,
+            aqiCategory="Good",
+            pm25=15,
+            pm10=28,
+            no2=25,
+            o3=38,
+            co=0.25,
+            so2=4,
+            population=5300000,
+            lat=-33.8688,
+            lon=151.2093,
+        ),
+        SampleCity(
+            city="Melbourne",
+            aqiIndex=35,
+            aqiCategory="Good",
+            pm25=14,
+            pm10=25,
+            no2=22,
+            o3=35,
+            co=0.22,
+            so2=3,
+            population=5000000,
+            lat=-37.8136,
+            lon=144.9631,
+        ),
     ],
 }
 
 
+# Lookup indexes over SAMPLE_CITIES, built once at import (sample city names
+# are unique across countries)
+_CITY_BY_NAME: Dict[str, SampleCity] = {
+    city.city: city for cities in SAMPLE_CITIES.values() for city in cities
+}
+_CITY_BY_CC_NAME: Dict[Tuple[str, str], SampleCity] = {
+    (cc, city.city): city for cc, cities in SAMPLE_CITIES.items() for city in cities
+}
+# Dict form of each city for API responses - asdict() is too slow to run per request.
+# Shared, so callers copy before adding fields.
+_CITY_DICTS: Dict[Tuple[str, str], Dict[str, Any]] = {
+    key: asdict(city) for key, city in _CITY_BY_CC_NAME.items()
+}
+_CITY_DICTS_BY_CC: Dict[str, List[Dict[str, Any]]] = {
+    cc: [_CITY_DICTS[(cc, city.city)] for city in cities] for cc, cities in SAMPLE_CITIES.items()
+}
+
+
+# Base readings for cities that aren't in SAMPLE_CITIES
+_DEFAULT_HISTORY_BASE = SampleCity(
+    city="",
+    aqiIndex=100,
+    aqiCategory="",
+    pm25=50,
+    pm10=75,
+    no2=40,
+    o3=40,
+    co=0.5,
+    so2=10,
+    population=0,
+    lat=0,
+    lon=0,
+)
+
+_rng = np.random.default_rng()
+
+
 def generate_historical_data(city: str, days: int = 30) -> List[Dict[str, Any]]:
-    base_data = None
-    for country_cities in SAMPLE_CITIES.values():
-        for city_data in country_cities:
-            if city_data["city"] == city:
-                base_data = city_data
-                break
-        if base_data:
-            break
-
-    if not base_data:
-        base_data = {"pm25": 50, "pm10": 75, "aqiIndex": 100}
-
-    history = []
-    base_date = datetime.now()
+    base_data = _CITY_BY_NAME.get(city) or _DEFAULT_HISTORY_BASE
 
-    for i in range(days, 0, -1):
-        date = base_date - timedelta(days=i)
-        variation = random.uniform(0.7, 1.3)
-        seasonal_factor = 1 + 0.2 * (i % 7 - 3) / 7
-
-        history.append({
-            "date": date.strftime("%Y-%m-%d"),
-            "pm25": round(base_data["pm25"] * variation * seasonal_factor, 1),
-            "pm10": round(base_data["pm10"] * variation * seasonal_factor, 1),
-            "no2": round(base_data.get("no2", 40) * variation, 1),
-            "o3": round(base_data.get("o3", 40) * variation, 1),
-            "co": round(base_data.get("co", 0.5) * variation, 2),
-            "so2": round(base_data.get("so2", 10) * variation, 1),
-            "aqiIndex": round(base_data["aqiIndex"] * variation * seasonal_factor),
-        })
+    # All days at once: day i (days..1 days ago) gets a random variation, and
+    # PM/AQI also a weekly seasonal factor
+    days_ago = np.arange(days, 0, -1)
+    variation = _rng.uniform(0.7, 1.3, days)
+    seasonal = variation * (1 + 0.2 * (days_ago % 7 - 3) / 7)
 
-    return history
+    pm25 = np.round(base_data.pm25 * seasonal, 1).tolist()
+    pm10 = np.round(base_data.pm10 * seasonal, 1).tolist()
+    no2 = np.round(base_data.no2 * variation, 1).tolist()
+    o3 = np.round(base_data.o3 * variation, 1).tolist()
+    co = np.round(base_data.co * variation, 2).tolist()
+    so2 = np.round(base_data.so2 * variation, 1).tolist()
+    aqi = np.rint(base_data.aqiIndex * seasonal).astype(np.int64).tolist()
 
+    base_date = datetime.now()
+    dates = [(base_date - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(days, 0, -1)]
 
-def generate_stations(city: str, country_code: str) -> List[Dict[str, Any]]:
-    city_data = None
-    for city_entry in SAMPLE_CITIES.get(country_code, []):
-        if city_entry["city"] == city:
-            city_data = city_entry
-            break
+    return [
+        {
+            "date": date,
+            "pm25": pm25[i],
+            "pm10": pm10[i],
+            "no2": no2[i],
+            "o3": o3[i],
+            "co": co[i],
+            "so2": so2[i],
+            "aqiIndex": aqi[i],
+        }
+        for i, date in enumerate(dates)
+    ]
 
+
+def generate_stations(city: str, country_code: str) -> List[Dict[str, Any]]:
+    city_data = _CITY_BY_CC_NAME.get((country_code, city))
     if not city_data:
         return []
 
@@ -367,6 +422,7 @@ def generate_stations(city: str, country_code: str) -> List[Dict[str, Any]]:
         f"{city} West",
     ]
 
+    now = datetime.now().isoformat()
     for i, name in enumerate(station_names[:3]):
         lat_offset = random.uniform(-0.05, 0.05)
         lon_offset = random.uniform(-0.05, 0.05)
@@ -374,75 +430,50 @@ def generate_stations(city: str, country_code: str) -> List[Dict[str, Any]]:
 
         stations.append({
             "stationName": name,
-            "latitude": round(city_data["lat"] + lat_offset, 4),
-            "longitude": round(city_data["lon"] + lon_offset, 4),
-            "pm25": round(city_data["pm25"] * variation, 1),
-            "pm10": round(city_data["pm10"] * variation, 1),
-            "no2": round(city_data["no2"] * variation, 1),
-            "o3": round(city_data["o3"] * variation, 1),
-            "co": round(city_data["co"] * variation, 2),
-            "so2": round(city_data["so2"] * variation, 1),
-            "aqiIndex": round(city_data["aqiIndex"] * variation),
-            "lastUpdated": datetime.now().isoformat(),
+            "latitude": round(city_data.lat + lat_offset, 4),
+            "longitude": round(city_data.lon + lon_offset, 4),
+            "pm25": round(city_data.pm25 * variation, 1),
+            "pm10": round(city_data.pm10 * variation, 1),
+            "no2": round(city_data.no2 * variation, 1),
+            "o3": round(city_data.o3 * variation, 1),
+            "co": round(city_data.co * variation, 2),
+            "so2": round(city_data.so2 * variation, 1),
+            "aqiIndex": round(city_data.aqiIndex * variation),
+            "lastUpdated": now,
         })
 
     return stations
 
 
-def get_aqi_category(aqi: int) -> str:
-    if aqi <= 50:
-        return "Good"
-    elif aqi <= 100:
-        return "Moderate"
-    elif aqi <= 150:
-        return "Unhealthy for Sensitive Groups"
-    elif aqi <= 200:
-        return "Unhealthy"
-    elif aqi <= 300:
-        return "Very Unhealthy"
-    else:
-        return "Hazardous"
-
-
 def get_countries() -> List[Dict[str, Any]]:
     result = []
     for country in SAMPLE_COUNTRIES:
         cities = SAMPLE_CITIES.get(country["code"], [])
         if cities:
-            avg_aqi = sum(c["aqiIndex"] for c in cities) / len(cities)
-            worst_city = max(cities, key=lambda c: c["aqiIndex"])
+            avg_aqi = sum(c.aqiIndex for c in cities) / len(cities)
+            worst_city = max(cities, key=lambda c: c.aqiIndex)
 
             result.append({
                 "code": country["code"],
                 "name": country["name"],
                 "cityCount": len(cities),
                 "averageAqi": round(avg_aqi),
-                "worstCity": worst_city["city"],
-                "worstCityAqi": worst_city["aqiIndex"],
+                "worstCity": worst_city.city,
+                "worstCityAqi": worst_city.aqiIndex,
             })
 
     return result
 
 
 def get_cities(country_code: str) -> List[Dict[str, Any]]:
-    cities = SAMPLE_CITIES.get(country_code, [])
+    cities = _CITY_DICTS_BY_CC.get(country_code, [])
     now = datetime.now().isoformat()
 
-    return [
-        {
-            **city,
-            "lastUpdated": now,
-        }
-        for city in cities
-    ]
+    return [dict(city, lastUpdated=now) for city in cities]
 
 
 def get_city_summary(city: str, country_code: str) -> Dict[str, Any]:
-    cities = SAMPLE_CITIES.get(country_code, [])
-    for city_data in cities:
-        if city_data["city"] == city:
-            return {
-                **city_data,
-                "lastUpdated": datetime.now().isoformat(),
-            }
+    city_data = _CITY_DICTS.get((country_code, city))
+    if city_data:
+        return dict(city_data, lastUpdated=datetime.now().isoformat())
     return None